@@ -2,6 +2,9 @@
 const CONFIG = {
     // Production GAS Web App URL (環境変数から読み込む)
     API_URL: process.env.GAS_API_URL || 'https://script.google.com/macros/s/YOUR_GAS_SCRIPT_ID/exec',
+    // ローカル Ingest サーバー (ingest_server.py)。設定時はチャンクをバイナリのまま直接送信
+    INGEST_URL: process.env.INGEST_URL || '',
+    INGEST_TOKEN: process.env.INGEST_TOKEN || '',
     MIME_TYPE: 'audio/webm;codecs=opus',
     CHUNK_DURATION: 5 * 60 * 1000, // 5分ごとにアップロード
     FILE_EXTENSION: '.webm'
@@ -16,6 +19,8 @@ let state = {
     audioStream: null,
     audioChunks: [],
     uploadedChunks: 0,
+    recordedChunks: 0,
+    pendingUploads: [],
     currentChunk: 0,
     sessionId: null,
     generatedData: null,
@@ -60,6 +65,8 @@ async function toggleRecording() {
 
             state.currentChunk = 0;
             state.uploadedChunks = 0;
+            state.recordedChunks = 0;
+            state.pendingUploads = [];
             state.audioChunks = [];
 
             state.mediaRecorder.ondataavailable = (e) => {
@@ -131,6 +138,9 @@ async function processChunk(isFinal = false, chunksOverride = null) {
         return;
     }
 
+    // 空の最終チャンクを除いた、録音したチャンク数（アップロードの成否は問わない）
+    state.recordedChunks = state.currentChunk;
+
     const blob = new Blob(chunks, { type: CONFIG.MIME_TYPE });
     const chunkNumber = String(state.currentChunk).padStart(2, '0');
     const fileName = `${state.sessionId}_chunk${chunkNumber}${CONFIG.FILE_EXTENSION}`;
@@ -138,7 +148,11 @@ async function processChunk(isFinal = false, chunksOverride = null) {
     console.log(`Uploading chunk: ${fileName}`);
 
     try {
-        await uploadToGAS(blob, fileName);
+        const upload = CONFIG.INGEST_URL
+            ? uploadToIngest(blob, chunkNumber)
+            : uploadToGAS(blob, fileName);
+        state.pendingUploads.push(upload);
+        await upload;
         state.uploadedChunks++;
         if (isFinal) {
             handleFinalGeneration();
@@ -172,7 +186,45 @@ async function uploadToGAS(blob, fileName) {
     });
 }
 
+async function uploadToIngest(blob, chunkNumber) {
+    const response = await fetch(`${CONFIG.INGEST_URL}/sessions/${state.sessionId}/chunks/${chunkNumber}`, {
+        method: 'PUT',
+        headers: { 'X-Ingest-Token': CONFIG.INGEST_TOKEN },
+        body: blob
+    });
+    if (!response.ok) {
+        const result = await response.json();
+        throw new Error(result.message);
+    }
+}
+
+async function completeIngestSession() {
+    // 送信中のチャンクがすべて届いてから完了を通知
+    await Promise.allSettled(state.pendingUploads);
+    const response = await fetch(`${CONFIG.INGEST_URL}/sessions/${state.sessionId}/complete`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Ingest-Token': CONFIG.INGEST_TOKEN },
+        body: JSON.stringify({ chunks: state.recordedChunks })
+    });
+    const result = await response.json();
+    if (result.status !== 'success') {
+        throw new Error(result.message);
+    }
+}
+
 async function handleFinalGeneration() {
+    if (CONFIG.INGEST_URL) {
+        els.status.innerText = 'サーバーに送信中...';
+        try {
+            await completeIngestSession();
+            els.status.innerText = '送信完了。文字起こし・台本生成・動画生成をサーバーで実行します。';
+        } catch (err) {
+            els.status.innerText = 'エラー: ' + err.message;
+            els.recText.innerText = 'RETRY';
+        }
+        return;
+    }
+
     els.status.innerText = '台本を生成中...';
     try {
         const response = await fetch(CONFIG.API_URL, {
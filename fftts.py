@@ -8,24 +8,25 @@ import os
 import sys
 import subprocess
 import asyncio
-import edge_tts
-import whisper
 import re
 import json
 import tempfile
 import shutil
+import time
+import uuid
+import socket
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from PIL import Image
+from urllib.parse import quote
 from dotenv import load_dotenv
-
-# Google API
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
 import io
 
+# whisper(torch) / edge_tts / PIL / Google API クライアントは読み込みが重いため、
+# 使用するステージの関数内で import する（未処理行がない定期実行を軽くするため）
+
 # ================================================
 # 環境設定
 # ================================================
@@ -53,8 +54,46 @@ BGM_FOLDER_ID = os.getenv("BGM_FOLDER_ID")
 VIDEO_FOLDER_ID = os.getenv("VIDEO_FOLDER_ID")
 TTS_FOLDER_ID = os.getenv("TTS_FOLDER_ID")
 
+# 動画生成中の行の確保（O列：人が編集する E列ステータスとは別の専用列）
+RENDERING_STATUS = "動画生成中"
+RENDER_CLAIM_COLUMN = "O"
+RENDER_CLAIM_INDEX = 14
+RENDER_CLAIM_TTL_SEC = int(os.getenv("RENDER_CLAIM_TTL_SEC", str(3 * 60 * 60)))
+CLAIM_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Google Drive フォルダインデックス（changes フィードで差分更新）
+DRIVE_INDEX_FILE = os.getenv("DRIVE_INDEX_FILE", "drive_index.json")
+DRIVE_PAGE_SIZE = 1000
+DRIVE_FILE_FIELDS = "id, name, mimeType, parents, trashed"
+DRIVE_FOLDER_MIME = "application/vnd.google-apps.folder"
+
+# ストリーミングアップロード（エンコードと並行して Drive へ送信）
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "").lower() in ("1", "true", "yes")
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 256KiB の倍数であること
+UPLOAD_MAX_RETRIES = 5
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
+
+# Sheets REST エンドポイント（--check 用の軽量パス）
+SHEETS_API_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+
+# 起動時間の目安（--bench-import で確認）
+IMPORT_BUDGET_SEC = 0.5
+HEAVY_MODULES = ("whisper", "torch", "edge_tts", "PIL", "googleapiclient", "google_auth_oauthlib")
+
 # ローカル一時作業ディレクトリ
-WORK_DIR = None  # セッション開始時に作成
+WORK_DIR = None  # セッション開始時に作成（大きなファイル用のディスク側）
+WORKSPACE = None  # SessionWorkspace（セッション開始時に作成）
+
+# 作業領域設定（小さな中間ファイルは RAM ディスクへ、容量予算で管理）
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or None
+SCRATCH_RAM_DIR = os.getenv("SCRATCH_RAM_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+SCRATCH_RAM_BUDGET = int(os.getenv("SCRATCH_RAM_BUDGET_MB", "512")) * 1024 * 1024
+SESSION_DISK_BUDGET = int(os.getenv("SESSION_DISK_BUDGET_MB", "2048")) * 1024 * 1024
+GLOBAL_DISK_BUDGET = int(os.getenv("GLOBAL_DISK_BUDGET_MB", "8192")) * 1024 * 1024
+SCRATCH_LEDGER_FILE = os.getenv(
+    "SCRATCH_LEDGER_FILE", os.path.join(tempfile.gettempdir(), "tiktok_rec_scratch.json"))
+HOT_FILE_ESTIMATE = 32 * 1024 * 1024  # RAM 配置可否の判定に使う1ファイルあたりの見込みサイズ
+SCRATCH_WAIT_TIMEOUT_SEC = int(os.getenv("SCRATCH_WAIT_TIMEOUT_SEC", "300"))  # ディスク予算の空き待ちの上限
 
 # フォント・レイアウト設定
 FONT_PART = "fontfile='C\:/Windows/Fonts/yumin.ttf'"
@@ -85,11 +124,566 @@ USE_FINAL_BLACK_MESSAGE = True
 FINAL_MESSAGE = "Japan is the last bastion."
 FINAL_MESSAGE_DURATION = 0.5
 
+# CPUリソース設定（ホスト全体で共有するコア予算）
+CPU_BUDGET = int(os.getenv("CPU_BUDGET", os.cpu_count() or 1))
+FFMPEG_JOB_THREADS = int(os.getenv("FFMPEG_JOB_THREADS", "2"))
+CPU_LEDGER_FILE = os.getenv(
+    "CPU_LEDGER_FILE", os.path.join(tempfile.gettempdir(), "tiktok_rec_cpu.json"))
+CPU_POLL_INTERVAL = 0.5
+
+# Google API レート制御（API ごとの秒間リクエスト数・バースト・同時実行数）
+API_LIMITS = {
+    "sheets": {
+        "rate": float(os.getenv("SHEETS_QPS", "1")),
+        "burst": 5,
+        "concurrency": int(os.getenv("SHEETS_MAX_CONCURRENCY", "2")),
+    },
+    "drive": {
+        "rate": float(os.getenv("DRIVE_QPS", "10")),
+        "burst": 20,
+        "concurrency": int(os.getenv("DRIVE_MAX_CONCURRENCY", "4")),
+    },
+}
+API_MAX_RETRIES = 6
+API_BACKOFF_BASE = 1.0
+API_BACKOFF_MAX = 64.0
+API_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+API_METRICS_FILE = os.getenv("API_METRICS_FILE")
+DRIVE_BATCH_LIMIT = 100
+
+# ================================================
+# CPUリソース管理（複数セッション間のスレッド割り当て）
+# ================================================
+def _pid_alive(pid):
+    """プロセスが生存しているか確認"""
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # Windows では os.kill(pid, 0) がプロセスを終了させるため OpenProcess で確認
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class FileLedger:
+    """
+    複数プロセスで共有する JSON 台帳（ロックファイルで排他制御）
+    形式：{pid: {lease_id: 数量}}、終了したプロセスの分は自動的に破棄
+    """
+    LOCK_STALE_SEC = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+
+    @contextmanager
+    def _locked(self):
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                # 異常終了で残ったロックは一定時間後に破棄
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) > self.LOCK_STALE_SEC:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(self.lock_path)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {pid: leases for pid, leases in data.items() if _pid_alive(int(pid))}
+
+    def update(self, fn):
+        """台帳をロックした状態で fn(data) を実行し、変更を保存して戻り値を返す"""
+        with self._locked():
+            data = self._load()
+            result = fn(data)
+            tmp_path = self.path + f".{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            return result
+
+    def total(self, data):
+        return sum(sum(leases.values()) for leases in data.values())
+
+class CpuScheduler:
+    """
+    ホスト全体のコア予算からスレッド数を払い出すスケジューラ
+    ffmpeg の -threads、torch のスレッド数、Pillow のワーカー数に利用
+    """
+
+    def __init__(self, budget, ledger_path):
+        self.budget = max(1, budget)
+        self.ledger = FileLedger(ledger_path)
+
+    def _try_grant(self, lease_id, want, minimum):
+        def grant(data):
+            remaining = self.budget - self.ledger.total(data)
+            if remaining < minimum:
+                return 0
+            granted = min(want, remaining)
+            data.setdefault(str(os.getpid()), {})[lease_id] = granted
+            return granted
+        return self.ledger.update(grant)
+
+    def _release(self, lease_id):
+        def release(data):
+            leases = data.get(str(os.getpid()), {})
+            leases.pop(lease_id, None)
+            if not leases:
+                data.pop(str(os.getpid()), None)
+        self.ledger.update(release)
+
+    @contextmanager
+    def lease(self, want, minimum=1):
+        """残り予算が minimum 以上になるまで待ち、最大 want スレッドを確保"""
+        want = max(1, min(want, self.budget))
+        minimum = max(1, min(minimum, want))
+        lease_id = uuid.uuid4().hex
+        granted = self._try_grant(lease_id, want, minimum)
+        while not granted:
+            time.sleep(CPU_POLL_INTERVAL)
+            granted = self._try_grant(lease_id, want, minimum)
+        try:
+            yield granted
+        finally:
+            self._release(lease_id)
+
+CPU_SCHEDULER = CpuScheduler(CPU_BUDGET, CPU_LEDGER_FILE)
+
+def with_ffmpeg_threads(cmd, threads):
+    """
+    ffmpeg の全段階のスレッド数を threads に制限したコマンドを返す
+    フィルタ（-filter_threads / -filter_complex_threads）、各入力のデコード（-i の直前）、
+    エンコード（出力ファイルの直前）にそれぞれ指定しないと既定値（全コア）で動く
+    """
+    threads = str(threads)
+    out_idx = len(cmd) - 2 if cmd[-1] == "-y" else len(cmd) - 1
+    limited = [cmd[0], "-filter_threads", threads, "-filter_complex_threads", threads]
+    for arg in cmd[1:out_idx]:
+        if arg == "-i":
+            limited += ["-threads", threads]
+        limited.append(arg)
+    return limited + ["-threads", threads] + cmd[out_idx:]
+
+def run_ffmpeg(cmd, threads=None, **kwargs):
+    """CPU予算からスレッドを確保して ffmpeg を実行"""
+    want = threads or FFMPEG_JOB_THREADS
+    with CPU_SCHEDULER.lease(want) as granted:
+        return subprocess.run(with_ffmpeg_threads(cmd, granted), **kwargs)
+
+# ================================================
+# 作業領域管理（RAM ディスク配置・容量予算）
+# ================================================
+class SessionWorkspace:
+    """
+    セッションの作業ディレクトリ
+    小さく頻繁に読み書きする中間ファイル（セグメント・結合リスト・音声）は RAM ディスク、
+    大きな成果物はディスクに置き、セッション単位とホスト全体の使用量を台帳で管理する
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.key = f"{session_id}:{uuid.uuid4().hex[:8]}"
+        self.ledger = FileLedger(SCRATCH_LEDGER_FILE)
+        self.lock = threading.Lock()
+        self.sizes = {}  # {path: (bytes, "disk" | "ram")}
+        self.pending = {}  # RAM 側に払い出したが未計上のパス {path: 見込みバイト数}
+        self.spilled = {}  # RAM 予算超過でディスクへ退避したファイル {RAM 側のパス: 退避先}
+
+        self._wait_for_disk_budget()
+        self.disk_dir = tempfile.mkdtemp(prefix=f"tiktok_rec_{session_id}_", dir=SCRATCH_DIR)
+        self.ram_dir = None
+        if SCRATCH_RAM_DIR and os.access(SCRATCH_RAM_DIR, os.W_OK):
+            self.ram_dir = tempfile.mkdtemp(prefix=f"tiktok_rec_{session_id}_", dir=SCRATCH_RAM_DIR)
+
+    def _ledger_total(self, data, tier):
+        return sum(
+            amount for leases in data.values()
+            for key, amount in leases.items() if key.endswith(f":{tier}")
+        )
+
+    def _disk_reservation(self, disk_used):
+        """未使用分の予約量（実使用量と合わせて1セッション分を確保し続ける）"""
+        return max(0, min(SESSION_DISK_BUDGET, GLOBAL_DISK_BUDGET) - disk_used)
+
+    def _wait_for_disk_budget(self):
+        """
+        ホスト全体の残り予算が1セッション分空くまで待ち、空いたら同じ更新内で予約する
+        SCRATCH_WAIT_TIMEOUT_SEC を過ぎても空かなければ TimeoutError
+        """
+        def reserve(data):
+            needed = self._disk_reservation(0)
+            if self._ledger_total(data, "disk") + needed > GLOBAL_DISK_BUDGET:
+                return False
+            data.setdefault(str(os.getpid()), {})[f"{self.key}:reserve:disk"] = needed
+            return True
+        notified = False
+        deadline = time.monotonic() + SCRATCH_WAIT_TIMEOUT_SEC
+        while not self.ledger.update(reserve):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"ディスク予算が {SCRATCH_WAIT_TIMEOUT_SEC} 秒以内に空きませんでした")
+            if not notified:
+                print("⏳ ディスク予算の空き待ち...")
+                notified = True
+            time.sleep(CPU_POLL_INTERVAL)
+
+    def path(self, name, hot=False):
+        """
+        ファイルの配置先パスを返す（hot=True は RAM ディスクに空きがあれば RAM 側）
+        RAM 側を返す場合は空き確認と同じ更新内で見込みサイズを予約し、charge で実サイズに置き換える
+        """
+        if hot and self.ram_dir:
+            ram_path = os.path.join(self.ram_dir, name)
+            with self.lock:
+                def reserve(data):
+                    if self._ledger_total(data, "ram") + HOT_FILE_ESTIMATE > SCRATCH_RAM_BUDGET:
+                        return False
+                    self.pending[ram_path] = HOT_FILE_ESTIMATE
+                    self._write_leases(data)
+                    return True
+                if ram_path in self.pending or self.ledger.update(reserve):
+                    return ram_path
+        return os.path.join(self.disk_dir, name)
+
+    def _tier(self, path):
+        if self.ram_dir and os.path.abspath(path).startswith(os.path.abspath(self.ram_dir) + os.sep):
+            return "ram"
+        return "disk"
+
+    def _totals(self):
+        totals = {"disk": 0, "ram": 0}
+        for size, tier in self.sizes.values():
+            totals[tier] += size
+        return totals
+
+    def _write_leases(self, data):
+        """このセッションの使用量・予約量を台帳に書き込む（self.lock と台帳ロックを保持して呼ぶ）"""
+        totals = self._totals()
+        leases = data.setdefault(str(os.getpid()), {})
+        for tier, total in totals.items():
+            leases[f"{self.key}:{tier}"] = total
+        leases[f"{self.key}:reserve:disk"] = self._disk_reservation(totals["disk"])
+        leases[f"{self.key}:pending:ram"] = sum(self.pending.values())
+        return totals
+
+    def _sync_ledger(self):
+        def update(data):
+            totals = self._write_leases(data)
+            return totals, self._ledger_total(data, "disk"), self._ledger_total(data, "ram")
+        return self.ledger.update(update)
+
+    def _spill_ram(self, excess):
+        """
+        RAM 側のファイルを大きい順にディスクへ移し、excess バイト以上を空ける（self.lock を保持して呼ぶ）
+        元のパスにはシンボリックリンクを残すので、呼び出し側は同じパスのまま使える
+        """
+        ram_files = sorted(
+            ((size, path) for path, (size, tier) in self.sizes.items() if tier == "ram"), reverse=True)
+        for size, path in ram_files:
+            if excess <= 0:
+                break
+            disk_path = os.path.join(self.disk_dir, f"spill_{uuid.uuid4().hex[:8]}_{os.path.basename(path)}")
+            shutil.move(path, disk_path)
+            os.symlink(disk_path, path)
+            self.spilled[path] = disk_path
+            self.sizes[path] = (size, "disk")
+            excess -= size
+            print(f"💾 RAM 予算超過のためディスクへ退避: {os.path.basename(path)} ({size / (1024 * 1024):.1f}MB)")
+
+    def charge(self, *paths):
+        """
+        生成済みファイルのサイズを計上し、予算超過ならエラー
+        RAM 側の実使用量が SCRATCH_RAM_BUDGET を超えた場合はディスクへ退避する
+        """
+        with self.lock:
+            for path in paths:
+                if not path:
+                    continue
+                self.pending.pop(path, None)
+                if os.path.isfile(path):
+                    tier = "disk" if path in self.spilled else self._tier(path)
+                    self.sizes[path] = (os.path.getsize(path), tier)
+            totals, global_disk, global_ram = self._sync_ledger()
+            if global_ram > SCRATCH_RAM_BUDGET:
+                self._spill_ram(global_ram - SCRATCH_RAM_BUDGET)
+                totals, global_disk, global_ram = self._sync_ledger()
+
+        session_total = totals["disk"] + totals["ram"]
+        if session_total > SESSION_DISK_BUDGET:
+            raise RuntimeError(
+                f"セッションの作業領域が予算を超えました: {session_total / (1024 * 1024):.1f}MB "
+                f"(上限 {SESSION_DISK_BUDGET / (1024 * 1024):.0f}MB)")
+        if global_disk > GLOBAL_DISK_BUDGET:
+            raise RuntimeError(
+                f"ホスト全体の作業領域が予算を超えました: {global_disk / (1024 * 1024):.1f}MB "
+                f"(上限 {GLOBAL_DISK_BUDGET / (1024 * 1024):.0f}MB)")
+
+    def release(self, *paths):
+        """後段で不要になった中間ファイルを削除して計上から外す"""
+        with self.lock:
+            for path in paths:
+                if not path:
+                    continue
+                self.sizes.pop(path, None)
+                self.pending.pop(path, None)
+                for target in (path, self.spilled.pop(path, None)):
+                    if not target:
+                        continue
+                    try:
+                        os.remove(target)
+                    except FileNotFoundError:
+                        pass
+            self._sync_ledger()
+
+    def usage(self):
+        """(ディスク使用量, RAM 使用量) をバイトで返す"""
+        with self.lock:
+            disk = sum(size for size, tier in self.sizes.values() if tier == "disk")
+            ram = sum(size for size, tier in self.sizes.values() if tier == "ram")
+        return disk, ram
+
+    def cleanup(self):
+        for directory in (self.disk_dir, self.ram_dir):
+            if directory and os.path.exists(directory):
+                shutil.rmtree(directory)
+
+        def remove(data):
+            leases = data.get(str(os.getpid()), {})
+            for lease_id in [lease_id for lease_id in leases if lease_id.startswith(f"{self.key}:")]:
+                leases.pop(lease_id)
+            if not leases:
+                data.pop(str(os.getpid()), None)
+        self.ledger.update(remove)
+
+# ================================================
+# Google API リクエスト制御（レート制限・リトライ・メトリクス）
+# ================================================
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限
+    レート制限エラー時はレートを半減し、成功が続くと設定値まで徐々に戻す
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得（不足時は待機）し、待機秒数を返す"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.5)
+            self.tokens = 0.0
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+def _api_error_status(e):
+    """例外から HTTP ステータスを取得（googleapiclient / requests 両対応）"""
+    resp = getattr(e, "resp", None)
+    if resp is not None and getattr(resp, "status", None) is not None:
+        return int(resp.status)
+    response = getattr(e, "response", None)
+    if response is not None and getattr(response, "status_code", None) is not None:
+        return int(response.status_code)
+    return None
+
+def _is_rate_limited(e):
+    status = _api_error_status(e)
+    return status == 429 or (status == 403 and "ratelimitexceeded" in str(e).lower())
+
+def _is_transport_error(e):
+    """
+    接続断・タイムアウトなど通信経路のエラーか
+    ディスク容量不足・権限・ファイルなしなどのローカルな OSError は再試行しても直らないので含めない
+    requests / httplib2 は読み込み済みの場合のみ判定（例外の送出元なら必ず読み込まれている）
+    """
+    if isinstance(e, (ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(e, requests.RequestException):
+        return True
+    httplib2 = sys.modules.get("httplib2")
+    return httplib2 is not None and isinstance(e, httplib2.HttpLib2Error)
+
+def _is_retryable(e):
+    status = _api_error_status(e)
+    if status is not None:
+        return status in API_RETRYABLE_STATUS or _is_rate_limited(e)
+    return _is_transport_error(e)
+
+def _backoff_delay(attempt):
+    """attempt 回目の再試行までの待機秒数（上限付き指数バックオフ + フルジッター）"""
+    return random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+
+class ApiGate:
+    """API ごとのレート制限・同時実行数制限・リトライをまとめて適用"""
+
+    def __init__(self, name, rate, burst, concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.metrics = {
+            "requests": 0,
+            "retries": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "throttle_wait_sec": 0.0,
+        }
+
+    def count(self, key, value=1):
+        """メトリクスを加算（ゲート外で独自に再試行する呼び出し側からも使う）"""
+        with self.lock:
+            self.metrics[key] += value
+
+    def execute(self, fn, retries=API_MAX_RETRIES):
+        """
+        fn() を実行し、リトライ可能なエラーは指数バックオフ（ジッター付き）で再試行
+        retries=0 は呼び出し側が独自に再開処理を行う場合（レート制限と計測のみ適用）
+        """
+        for attempt in range(retries + 1):
+            self.count("throttle_wait_sec", self.bucket.acquire())
+            with self.semaphore:
+                self.count("requests")
+                try:
+                    result = fn()
+                except Exception as e:
+                    if _is_rate_limited(e):
+                        self.count("rate_limited")
+                        self.bucket.slow_down()
+                    if not _is_retryable(e):
+                        self.count("errors")
+                        raise
+                    if attempt == retries:
+                        # retries=0 の再試行可能エラーは呼び出し側が再開・計上する
+                        if retries:
+                            self.count("errors")
+                        raise
+                    self.count("retries")
+                    error = e
+                else:
+                    self.bucket.speed_up()
+                    return result
+            delay = _backoff_delay(attempt)
+            print(f"⚠️ {self.name} API エラー（{_api_error_status(error) or type(error).__name__}）。{delay:.1f}秒後に再試行 ({attempt + 1}/{retries})")
+            time.sleep(delay)
+
+API_GATES = {name: ApiGate(name, **limits) for name, limits in API_LIMITS.items()}
+
+def api_execute(api, request, retries=API_MAX_RETRIES):
+    """
+    Google API リクエストを共通の制御下で実行
+    request は googleapiclient の HttpRequest（.execute を持つもの）または引数なしの関数
+    """
+    fn = request.execute if hasattr(request, "execute") else request
+    return API_GATES[api].execute(fn, retries)
+
+def api_execute_batch(api, service, batch_requests):
+    """
+    BatchHttpRequest でまとめて実行し、結果をリクエスト順のリストで返す（失敗分は例外オブジェクト）
+    個別にリトライ可能なエラーとなったリクエストだけを再送する
+    """
+    results = [None] * len(batch_requests)
+    pending = list(range(len(batch_requests)))
+
+    for attempt in range(API_MAX_RETRIES + 1):
+        retry = set()
+        for start in range(0, len(pending), DRIVE_BATCH_LIMIT):
+            group = pending[start:start + DRIVE_BATCH_LIMIT]
+
+            def callback(request_id, response, exception):
+                idx = int(request_id)
+                if exception is not None and _is_retryable(exception) and attempt < API_MAX_RETRIES:
+                    retry.add(idx)
+                results[idx] = exception if exception is not None else response
+
+            batch = service.new_batch_http_request(callback=callback)
+            for idx in group:
+                batch.add(batch_requests[idx], request_id=str(idx))
+            api_execute(api, batch)
+
+        if not retry:
+            break
+        API_GATES[api].count("retries", len(retry))
+        pending = sorted(retry)
+        time.sleep(random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt)))
+
+    return results
+
+def report_api_metrics():
+    """API 呼び出しのメトリクスを表示（API_METRICS_FILE 指定時は JSON Lines で追記）"""
+    snapshot = {}
+    for name, gate in API_GATES.items():
+        with gate.lock:
+            snapshot[name] = dict(gate.metrics, rate=round(gate.bucket.rate, 3))
+
+    print("\n📈 Google API メトリクス:")
+    for name, metrics in snapshot.items():
+        print(
+            f"  {name}: requests={metrics['requests']} retries={metrics['retries']} "
+            f"errors={metrics['errors']} rate_limited={metrics['rate_limited']} "
+            f"wait={metrics['throttle_wait_sec']:.1f}s rate={metrics['rate']}/s"
+        )
+
+    if API_METRICS_FILE:
+        try:
+            os.makedirs(os.path.dirname(API_METRICS_FILE) or ".", exist_ok=True)
+            with open(API_METRICS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"time": time.time(), "pid": os.getpid(), "apis": snapshot}) + "\n")
+        except OSError as e:
+            print(f"⚠️ メトリクスを書き込めません: {e}")
+    return snapshot
+
 # ================================================
 # Google API認証
 # ================================================
 def get_google_credentials():
     """Google APIの認証情報を取得"""
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
     creds = None
     
     # token.json が存在する場合、保存されたトークンを使う
@@ -103,6 +697,7 @@ def get_google_credentials():
             creds.refresh(Request())
         else:
             # 初回認証フロー（ブラウザで認証）
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(
                 GCP_CREDS_FILE, SCOPES)
             creds = flow.run_local_server(port=8080)
@@ -115,29 +710,40 @@ def get_google_credentials():
 
 def get_sheets_service():
     """Google Sheets APIサービスを取得"""
+    from googleapiclient.discovery import build
     creds = get_google_credentials()
     return build('sheets', 'v4', credentials=creds)
 
 def get_drive_service():
     """Google Drive APIサービスを取得"""
+    from googleapiclient.discovery import build
     creds = get_google_credentials()
     return build('drive', 'v3', credentials=creds)
 
+def fetch_sheet_values(range_name):
+    """Sheets API を REST で直接呼び出して値を取得（discovery を読み込まない軽量版）"""
+    from google.auth.transport.requests import AuthorizedSession
+
+    session = AuthorizedSession(get_google_credentials())
+
+    def fetch():
+        response = session.get(f"{SHEETS_API_URL}/{SPREADSHEET_ID}/values/{quote(range_name, safe='')}")
+        response.raise_for_status()
+        return response.json()
+
+    return api_execute("sheets", fetch)
+
 # ================================================
 # スプレッドシート操作
 # ================================================
 def scan_unprocessed_rows():
     """
     スプレッドシートから未処理の行を検出
-    条件：F列（日本語）≠空 かつ I列（動画ファイルID）= 空
-    戻り値：[(session_id, row_num), ...] のリスト
+    条件：F列（日本語）≠空 かつ I列（動画ファイルID）= 空 かつ 他プロセスが生成中でない（O列）
+    戻り値：[(session_id, row_num), ...] のリスト（取得に失敗した場合は None）
     """
     try:
-        service = get_sheets_service()
-        result = service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='txt!A:I'  # txt シートの A列～I列を取得
-        ).execute()
+        result = fetch_sheet_values(f'txt!A:{RENDER_CLAIM_COLUMN}')  # txt シートの A列～O列を取得
         
         rows = result.get('values', [])
         if not rows:
@@ -149,13 +755,18 @@ def scan_unprocessed_rows():
             # A列（Index 0）= session_id
             # F列（Index 5）= 日本語テキスト
             # I列（Index 8）= 動画ファイルID
+            # O列（Index 14）= 動画生成中の確保
             
             session_id = row[0] if len(row) > 0 else ""
+            claim = row[RENDER_CLAIM_INDEX] if len(row) > RENDER_CLAIM_INDEX else ""
             japanese_text = row[5] if len(row) > 5 else ""
             video_file_id = row[8] if len(row) > 8 else ""
             
             # 条件：F列≠空 かつ I列=空
             if japanese_text.strip() and not video_file_id.strip():
+                if is_render_claimed(claim):
+                    print(f"  Row {row_idx}: {session_id} は生成中のためスキップ")
+                    continue
                 unprocessed.append((session_id, row_idx))
         
         print(f"📋 未処理の行を検出：{len(unprocessed)}件")
@@ -166,7 +777,7 @@ def scan_unprocessed_rows():
     
     except Exception as e:
         print(f"❌ スプレッドシート スキャンエラー: {e}")
-        return []
+        return None
 
 def get_text_from_sheet(session_id):
     """
@@ -175,10 +786,10 @@ def get_text_from_sheet(session_id):
     """
     try:
         service = get_sheets_service()
-        result = service.spreadsheets().values().get(
+        result = api_execute("sheets", service.spreadsheets().values().get(
             spreadsheetId=SPREADSHEET_ID,
             range='txt!A:K'  # txt シート の A列～K列を取得
-        ).execute()
+        ))
         
         rows = result.get('values', [])
         if not rows:
@@ -220,10 +831,10 @@ def update_sheet_video_id(session_id, video_id):
         service = get_sheets_service()
         
         # session_id の行番号を特定
-        result = service.spreadsheets().values().get(
+        result = api_execute("sheets", service.spreadsheets().values().get(
             spreadsheetId=SPREADSHEET_ID,
             range='txt!A:A'  # session_id を探すため A列をスキャン
-        ).execute()
+        ))
         
         values = result.get('values', [])
         row_num = None
@@ -243,12 +854,12 @@ def update_sheet_video_id(session_id, video_id):
             'values': [[video_id]]
         }
         
-        service.spreadsheets().values().update(
+        api_execute("sheets", service.spreadsheets().values().update(
             spreadsheetId=SPREADSHEET_ID,
             range=cell_range,
             valueInputOption='USER_ENTERED',
             body=update_range_data
-        ).execute()
+        ))
         
         print(f"✅ スプレッドシート I列を更新: Row {row_num} = {video_id}")
         return True
@@ -257,11 +868,242 @@ def update_sheet_video_id(session_id, video_id):
         print(f"❌ スプレッドシート更新エラー: {e}")
         return False
 
+def is_render_claimed(claim):
+    """O列の値が有効な「動画生成中」の確保かどうか（期限切れの確保は無効）"""
+    if not claim.startswith(RENDERING_STATUS):
+        return False
+    try:
+        claimed_at = time.mktime(time.strptime(claim[len(RENDERING_STATUS):].split()[0], CLAIM_TIME_FORMAT))
+    except (ValueError, IndexError):
+        return True
+    return time.time() - claimed_at < RENDER_CLAIM_TTL_SEC
+
+def _read_render_claim(service, session_id):
+    """session_id の行（最新の行を優先）の (行番号, O列の値) を返す（見つからなければ (None, None)）"""
+    result = api_execute("sheets", service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID,
+        range=f'txt!A:{RENDER_CLAIM_COLUMN}'
+    ))
+    rows = result.get('values', [])
+    for i in range(len(rows) - 1, 0, -1):
+        if len(rows[i]) > 0 and str(rows[i][0]) == session_id:
+            row = rows[i]
+            return i + 1, row[RENDER_CLAIM_INDEX] if len(row) > RENDER_CLAIM_INDEX else ""
+    return None, None
+
+def _read_cell(service, cell_range):
+    result = api_execute("sheets", service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID,
+        range=cell_range
+    ))
+    values = result.get('values', [])
+    return values[0][0] if values and values[0] else ""
+
+def _write_cell(service, cell_range, value):
+    api_execute("sheets", service.spreadsheets().values().update(
+        spreadsheetId=SPREADSHEET_ID,
+        range=cell_range,
+        valueInputOption='RAW',
+        body={'values': [[value]]}
+    ))
+
+def claim_render(session_id):
+    """
+    session_id の行を動画生成中として O列で確保
+    戻り値：このプロセス固有の確保文字列（他のプロセスが確保済みなら None）
+    """
+    service = get_sheets_service()
+    row_num, current = _read_render_claim(service, session_id)
+    if not row_num:
+        raise ValueError(f"Session ID '{session_id}' がスプレッドシートに見つかりません")
+    if is_render_claimed(current):
+        return None
+
+    claim = f"{RENDERING_STATUS} {time.strftime(CLAIM_TIME_FORMAT)} {uuid.uuid4().hex[:8]}"
+    cell_range = f'txt!{RENDER_CLAIM_COLUMN}{row_num}'
+    _write_cell(service, cell_range, claim)
+    # 同時に確保したプロセスがあれば後から書いた方が勝つ（読み戻して自分の確保か確認）
+    if _read_cell(service, cell_range) != claim:
+        return None
+    return claim
+
+def release_render_claim(session_id, claim):
+    """O列がまだこのプロセスの確保のままなら解除（他プロセス・手動の変更は上書きしない）"""
+    try:
+        service = get_sheets_service()
+        row_num, current = _read_render_claim(service, session_id)
+        if row_num and current == claim:
+            _write_cell(service, f'txt!{RENDER_CLAIM_COLUMN}{row_num}', "")
+    except Exception as e:
+        print(f"❌ 動画生成の確保の解除エラー: {e}")
+
+# ================================================
+# Google Drive フォルダインデックス
+# ================================================
+class DriveFolderIndex:
+    """
+    フォルダ内ファイル一覧のローカルインデックス
+    初回のみ全ページを取得し、以降は changes.list のページトークンで差分だけ反映する
+    service には Drive v3 互換のオブジェクト（テスト用のフェイクも可）を渡す
+    """
+
+    def __init__(self, service, path=DRIVE_INDEX_FILE):
+        self.service = service
+        self.path = path
+        self.page_token = None
+        self.folders = {}  # {folder_id: {file_id: {"name": ..., "mimeType": ...}}}
+        self._synced = False
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.page_token = data.get("page_token")
+            self.folders = data.get("folders", {})
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Driveインデックスを読み込めません（再構築します）: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        # 複数プロセス・スレッドが同時に保存しても一時ファイルが衝突しないようにする
+        tmp_path = self.path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"page_token": self.page_token, "folders": self.folders}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        """インデックスを破棄（次回アクセス時に再取得）"""
+        self.page_token = None
+        self.folders = {}
+        self._synced = False
+
+    def _list_request(self, folder_id, page_token=None):
+        return self.service.files().list(
+            q=f"'{folder_id}' in parents and trashed=false",
+            spaces='drive',
+            fields=f'nextPageToken, files({DRIVE_FILE_FIELDS})',
+            pageSize=DRIVE_PAGE_SIZE,
+            pageToken=page_token
+        )
+
+    def _list_all(self, folder_id, first_page=None):
+        """フォルダ内のファイルを全ページ取得（first_page があれば2ページ目から取得）"""
+        files = {}
+        page_token = None
+        while True:
+            if first_page is not None:
+                results, first_page = first_page, None
+            else:
+                results = api_execute("drive", self._list_request(folder_id, page_token))
+            for file in results.get('files', []):
+                files[file['id']] = {'name': file['name'], 'mimeType': file.get('mimeType', '')}
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def _apply_change(self, change):
+        file_id = change['fileId']
+        for entries in self.folders.values():
+            entries.pop(file_id, None)
+
+        file = change.get('file')
+        if change.get('removed') or not file or file.get('trashed'):
+            return
+        for parent in file.get('parents', []):
+            if parent in self.folders:
+                self.folders[parent][file_id] = {'name': file['name'], 'mimeType': file.get('mimeType', '')}
+
+    def sync(self):
+        """changes フィードから前回以降の変更を反映"""
+        if self.page_token is None:
+            # 一覧取得より先にトークンを確保し、取得中の変更を取りこぼさない
+            self.folders = {}
+            self.page_token = api_execute("drive", self.service.changes().getStartPageToken())['startPageToken']
+        else:
+            page_token = self.page_token
+            while page_token:
+                results = api_execute("drive", self.service.changes().list(
+                    pageToken=page_token,
+                    spaces='drive',
+                    includeRemoved=True,
+                    fields=f'nextPageToken, newStartPageToken, changes(fileId, removed, file({DRIVE_FILE_FIELDS}))',
+                    pageSize=DRIVE_PAGE_SIZE
+                ))
+                for change in results.get('changes', []):
+                    self._apply_change(change)
+                if 'newStartPageToken' in results:
+                    self.page_token = results['newStartPageToken']
+                page_token = results.get('nextPageToken')
+        self._synced = True
+        self.save()
+
+    def prefetch(self, folder_ids):
+        """未取得のフォルダの1ページ目をバッチリクエストでまとめて取得"""
+        self._ensure_synced()
+        missing = [folder_id for folder_id in dict.fromkeys(folder_ids) if folder_id and folder_id not in self.folders]
+        if len(missing) < 2 or not hasattr(self.service, 'new_batch_http_request'):
+            return
+        first_pages = api_execute_batch("drive", self.service, [self._list_request(folder_id) for folder_id in missing])
+        for folder_id, first_page in zip(missing, first_pages):
+            if isinstance(first_page, Exception):
+                print(f"⚠️ フォルダ一覧のバッチ取得に失敗: {folder_id} ({first_page})")
+                continue
+            self.folders[folder_id] = self._list_all(folder_id, first_page)
+        self.save()
+
+    def refresh(self):
+        """changes フィードの差分を取り込む（変更がなければ1リクエストで終わる）"""
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"⚠️ Drive変更フィードの取得に失敗（インデックスを再構築します）: {e}")
+            self.reset()
+            self.sync()
+
+    def _ensure_synced(self):
+        if not self._synced:
+            self.refresh()
+
+    def list_folder(self, folder_id, mime_type=None):
+        """フォルダ内のファイル一覧を返す（[{'id', 'name', 'mimeType'}, ...]）"""
+        self._ensure_synced()
+
+        if folder_id not in self.folders:
+            self.folders[folder_id] = self._list_all(folder_id)
+            self.save()
+
+        return [
+            {'id': file_id, **meta}
+            for file_id, meta in self.folders[folder_id].items()
+            if mime_type is None or meta['mimeType'] == mime_type
+        ]
+
+    def add_file(self, folder_id, file_id, name, mime_type):
+        """自身がアップロードしたファイルを即時反映"""
+        if folder_id in self.folders:
+            self.folders[folder_id][file_id] = {'name': name, 'mimeType': mime_type}
+            self.save()
+
+_drive_index = None
+
+def get_drive_index():
+    """プロセス内で共有する Drive フォルダインデックスを取得"""
+    global _drive_index
+    if _drive_index is None:
+        _drive_index = DriveFolderIndex(get_drive_service())
+    return _drive_index
+
 # ================================================
 # Google Drive ダウンロード・アップロード
 # ================================================
 def download_file_from_drive(file_id, output_path):
     """Google Drive からファイルをダウンロード"""
+    from googleapiclient.http import MediaIoBaseDownload
+
     try:
         service = get_drive_service()
         request = service.files().get_media(fileId=file_id)
@@ -270,7 +1112,7 @@ def download_file_from_drive(file_id, output_path):
             downloader = MediaIoBaseDownload(f, request)
             done = False
             while not done:
-                status, done = downloader.next_chunk()
+                status, done = api_execute("drive", downloader.next_chunk)
         
         print(f"✅ ダウンロード成功: {output_path}")
         return output_path
@@ -282,13 +1124,10 @@ def download_file_from_drive(file_id, output_path):
 def download_bgm_by_genre(bgm_genre):
     """BGMジャンルに応じてサブフォルダからランダムにBGMを取得"""
     try:
-        service = get_drive_service()
-        import random
+        index = get_drive_index()
         
         # BGM フォルダ直下のサブフォルダを検索（chill または energy）
-        query = f"'{BGM_FOLDER_ID}' in parents and trashed=false and mimeType='application/vnd.google-apps.folder'"
-        results = service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=10).execute()
-        folders = results.get('files', [])
+        folders = index.list_folder(BGM_FOLDER_ID, DRIVE_FOLDER_MIME)
         
         target_folder_id = None
         for folder in folders:
@@ -301,9 +1140,7 @@ def download_bgm_by_genre(bgm_genre):
             target_folder_id = BGM_FOLDER_ID
         
         # ジャンルフォルダ内のファイルをすべて取得
-        query = f"'{target_folder_id}' in parents and trashed=false and mimeType='audio/mpeg'"
-        results = service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=100).execute()
-        files = results.get('files', [])
+        files = index.list_folder(target_folder_id, 'audio/mpeg')
         
         if not files:
             print(f"⚠️ BGMフォルダにファイルが見つかりません")
@@ -316,8 +1153,13 @@ def download_bgm_by_genre(bgm_genre):
         output_path = os.path.join(WORK_DIR, file_name)
         
         print(f"🎵 BGM選択: {file_name}")
-        return download_file_from_drive(file_id, output_path)
+        downloaded = download_file_from_drive(file_id, output_path)
+        WORKSPACE.charge(downloaded)
+        return downloaded
     
+    except RuntimeError:
+        # 作業領域の予算超過は握りつぶさずにセッションを止める
+        raise
     except Exception as e:
         print(f"❌ BGMダウンロードエラー: {e}")
         return None
@@ -325,12 +1167,7 @@ def download_bgm_by_genre(bgm_genre):
 def download_all_files_from_folder(folder_id, output_dir, num_select=None):
     """フォルダ内の全ファイルをダウンロード、オプションでランダム選出"""
     try:
-        service = get_drive_service()
-        import random
-        
-        query = f"'{folder_id}' in parents and trashed=false"
-        results = service.files().list(q=query, spaces='drive', fields='files(id, name)', pageSize=100).execute()
-        files = results.get('files', [])
+        files = get_drive_index().list_folder(folder_id)
         
         if not files:
             print(f"⚠️ フォルダにファイルが見つかりません: {folder_id}")
@@ -344,6 +1181,7 @@ def download_all_files_from_folder(folder_id, output_dir, num_select=None):
             
             if download_file_from_drive(file_id, output_path):
                 downloaded_files.append(output_path)
+                WORKSPACE.charge(output_path)
         
         print(f"✅ {len(downloaded_files)} 個のファイルをダウンロード")
         
@@ -354,51 +1192,65 @@ def download_all_files_from_folder(folder_id, output_dir, num_select=None):
         
         return downloaded_files
     
+    except RuntimeError:
+        # 作業領域の予算超過は握りつぶさずにセッションを止める
+        raise
     except Exception as e:
         print(f"❌ フォルダダウンロードエラー: {e}")
         return []
 
+def next_video_file_name(folder_id, session_id):
+    """アップロード先のファイル名を決定 (YYMMDD_連番.mp4)"""
+    # session_id から YYMMDD を抽出
+    date_match = re.match(r'^(\d{2,4})(\d{2})(\d{2})', session_id)
+    if date_match:
+        # YYMMDD 形式に統一
+        yymmdd = date_match.group(1)[-2:] + date_match.group(2) + date_match.group(3)
+    else:
+        yymmdd = '000000'
+    
+    # video フォルダ内で YYMMDD_*.mp4 の最大連番を探す
+    # 他プロセス・他セッションのアップロードを反映するため直前に差分同期
+    index = get_drive_index()
+    index.refresh()
+    existing_files = [f for f in index.list_folder(folder_id) if f['name'].startswith(f"{yymmdd}_")]
+    
+    max_num = 0
+    for existing_file in existing_files:
+        match = re.search(r'_([0-9]+)\.mp4$', existing_file['name'])
+        if match:
+            num = int(match.group(1))
+            if num > max_num:
+                max_num = num
+    
+    next_num = str(max_num + 1).zfill(2)
+    return f"{yymmdd}_{next_num}.mp4"
+
 def upload_file_to_drive(file_path, folder_id, session_id):
     """ファイルを Google Drive にアップロード (YYMMDD_連番 形式)"""
+    from googleapiclient.http import MediaFileUpload
+
     try:
         service = get_drive_service()
-        
-        # session_id から YYMMDD を抽出
-        date_match = re.match(r'^(\d{2,4})(\d{2})(\d{2})', session_id)
-        if date_match:
-            # YYMMDD 形式に統一
-            yymmdd = date_match.group(1)[-2:] + date_match.group(2) + date_match.group(3)
-        else:
-            yymmdd = '000000'
-        
-        # video フォルダ内で YYMMDD_*.mp4 の最大連番を探す
-        query = f"'{folder_id}' in parents and trashed=false and name contains '{yymmdd}_'"
-        results = service.files().list(q=query, spaces='drive', fields='files(name)', pageSize=100).execute()
-        existing_files = results.get('files', [])
-        
-        max_num = 0
-        for existing_file in existing_files:
-            match = re.search(r'_([0-9]+)\.mp4$', existing_file['name'])
-            if match:
-                num = int(match.group(1))
-                if num > max_num:
-                    max_num = num
-        
-        next_num = str(max_num + 1).zfill(2)
-        file_name = f"{yymmdd}_{next_num}.mp4"
+        file_name = next_video_file_name(folder_id, session_id)
         
         file_metadata = {
             'name': file_name,
             'parents': [folder_id]
         }
         
-        media = MediaFileUpload(file_path, mimetype='video/mp4')
-        file = service.files().create(
+        # resumable にしておくと、通信エラー時の再試行が重複作成ではなく続きからの再開になる
+        media = MediaFileUpload(file_path, mimetype='video/mp4', chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        request = service.files().create(
             body=file_metadata,
             media_body=media,
             fields='id'
-        ).execute()
+        )
+        file = None
+        while file is None:
+            status, file = api_execute("drive", request.next_chunk)
         
+        get_drive_index().add_file(folder_id, file['id'], file_name, 'video/mp4')
         print(f"✅ アップロード成功: {file_name} (ID: {file['id']})")
         return file['id']
     
@@ -406,12 +1258,158 @@ def upload_file_to_drive(file_path, folder_id, session_id):
         print(f"❌ アップロードエラー: {e}")
         return None
 
+class ResumableUpload:
+    """
+    Drive の resumable upload セッション
+    総サイズが未確定のままチャンク送信し、通信断時はサーバーが受領済みのオフセットから再開する
+    """
+
+    def __init__(self, session, metadata, mimetype):
+        self.session = session
+        self.metadata = metadata
+        self.mimetype = mimetype
+        self.url = None
+        self.offset = 0  # サーバーが受領済みのバイト数
+        self.result = None
+
+    def start(self):
+        def create_session():
+            response = self.session.post(
+                f"{DRIVE_UPLOAD_URL}?uploadType=resumable&fields=id",
+                json=self.metadata,
+                headers={'X-Upload-Content-Type': self.mimetype}
+            )
+            response.raise_for_status()
+            return response.headers['Location']
+        self.url = api_execute("drive", create_session)
+
+    def _handle_response(self, response):
+        """レスポンスから受領済みオフセットを更新"""
+        if response.status_code in (200, 201):
+            self.result = response.json()
+            return
+        if response.status_code == 308:
+            # Range: bytes=0-N （未受領ならヘッダーなし）
+            received = response.headers.get('Range')
+            offset = int(received.split('-')[1]) + 1 if received else 0
+            if offset < self.offset:
+                # 受領済みと報告された分は手元のバッファから破棄済みのため再送できない
+                raise RuntimeError(f"受領済みオフセットが後退しました ({self.offset} → {offset})")
+            self.offset = offset
+            return
+        # 429 / 5xx もステータス付きの HTTPError として送出し、drive のゲートでレート制限として扱う
+        response.raise_for_status()
+
+    def _request(self, method, **kwargs):
+        """
+        drive のレート制限・計測の下で送信してオフセットを更新
+        再試行はオフセットを確認する send 側で行う
+        """
+        api_execute("drive", lambda: self._handle_response(self.session.request(method, self.url, **kwargs)), retries=0)
+
+    def _query_offset(self, total):
+        self._request('PUT', headers={'Content-Range': f'bytes */{total}'})
+
+    def send(self, buffer, start, final):
+        """
+        buffer（ストリーム上の start バイト目から）を送信し、受領済みオフセットを返す
+        final=True の場合は総サイズを確定させてアップロードを完了する
+        """
+        import requests
+
+        total = start + len(buffer) if final else '*'
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            if self.offset < start:
+                raise RuntimeError(f"再送に必要なデータがバッファにありません (offset={self.offset}, start={start})")
+            data = bytes(buffer[self.offset - start:])
+            try:
+                if data:
+                    content_range = f'bytes {self.offset}-{self.offset + len(data) - 1}/{total}'
+                    self._request('PUT', data=data, headers={'Content-Range': content_range})
+                else:
+                    self._query_offset(total)
+                return self.offset
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                if attempt == UPLOAD_MAX_RETRIES:
+                    API_GATES["drive"].count("errors")
+                    raise
+                API_GATES["drive"].count("retries")
+                wait = _backoff_delay(attempt)
+                print(f"⚠️ アップロード中断（{e}）。{wait:.1f}秒後に再開します")
+                time.sleep(wait)
+                try:
+                    self._query_offset(total)
+                except requests.RequestException:
+                    pass
+
+    def finish(self, buffer, start):
+        """残りを送信して総サイズを確定（一部だけ受領された場合は続きを送り直す）"""
+        while self.result is None:
+            previous = self.offset
+            self.send(buffer, start, final=True)
+            if self.result is None and self.offset == previous:
+                raise RuntimeError("アップロードが完了しませんでした")
+        return self.result
+
+    def cancel(self):
+        import requests
+
+        if self.url:
+            try:
+                api_execute("drive", lambda: self.session.delete(self.url), retries=0)
+            except requests.RequestException:
+                pass
+
+def stream_upload_to_drive(stream, folder_id, file_name, mimetype='video/mp4', commit_check=None):
+    """
+    読み込み可能なストリームを Drive へチャンク送信し、ファイルIDを返す
+    commit_check はストリーム終端後・最終チャンク送信前に呼ばれ、False なら確定せずに破棄して None を返す
+    """
+    from google.auth.transport.requests import AuthorizedSession
+
+    session = AuthorizedSession(get_google_credentials())
+    upload = ResumableUpload(session, {'name': file_name, 'parents': [folder_id]}, mimetype)
+    upload.start()
+
+    buffer = bytearray()
+    buffer_start = 0  # buffer 先頭のストリーム上の位置
+    try:
+        while True:
+            data = stream.read(UPLOAD_CHUNK_SIZE)
+            if data:
+                buffer += data
+            eof = not data
+
+            if eof:
+                if commit_check and not commit_check():
+                    upload.cancel()
+                    return None
+                upload.finish(buffer, buffer_start)
+                break
+            # 途中のチャンクは 256KiB の倍数単位でしか送れない
+            while len(buffer) >= UPLOAD_CHUNK_SIZE:
+                acked = upload.send(buffer[:UPLOAD_CHUNK_SIZE], buffer_start, final=False)
+                del buffer[:acked - buffer_start]
+                buffer_start = acked
+    except BaseException:
+        upload.cancel()
+        raise
+
+    file_id = upload.result['id']
+    get_drive_index().add_file(folder_id, file_id, file_name, mimetype)
+    print(f"✅ ストリーミングアップロード成功: {file_name} (ID: {file_id}, {buffer_start + len(buffer)} bytes)")
+    return file_id
+
 # ================================================
 # TTSナレーション生成
 # ================================================
 async def generate_narration(english_text):
     """edge_tts を使ってナレーション生成"""
-    narration_path = os.path.join(WORK_DIR, "narration_edge.mp3")
+    import edge_tts
+
+    narration_path = WORKSPACE.path("narration_edge.mp3", hot=True)
     
     print(f"🎤 TTS生成開始: {english_text[:50]}...")
     
@@ -424,6 +1422,7 @@ async def generate_narration(english_text):
     )
     
     await communicate.save(narration_path)
+    WORKSPACE.charge(narration_path)
     print(f"✅ TTS生成完了: {narration_path}")
     return narration_path
 
@@ -432,6 +1431,8 @@ async def generate_narration(english_text):
 # ================================================
 def convert_to_tiktok_vertical(input_path, target_size=(1080, 1920)):
     """画像をTikTok縦型に変換（上書き）"""
+    from PIL import Image
+
     if not os.path.isfile(input_path):
         return None
     
@@ -454,6 +1455,14 @@ def convert_to_tiktok_vertical(input_path, target_size=(1080, 1920)):
     background.save(input_path, quality=95)
     return input_path
 
+def convert_images_to_tiktok_vertical(image_paths):
+    """CPU予算の範囲内で並列に画像を縦型変換"""
+    if not image_paths:
+        return []
+    with CPU_SCHEDULER.lease(len(image_paths)) as workers:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(convert_to_tiktok_vertical, image_paths))
+
 # ================================================
 # テキスト分割
 # ================================================
@@ -496,8 +1505,14 @@ def get_timestamps_from_whisper(mp3_path):
         print(f"🔴 mp3が見つかりません: {mp3_path}")
         sys.exit(1)
 
-    model = whisper.load_model("base.en")
-    result = model.transcribe(mp3_path, word_timestamps=True)
+    import torch
+    import whisper
+
+    # torch の intra-op スレッド数を CPU予算から割り当て
+    with CPU_SCHEDULER.lease(CPU_BUDGET) as threads:
+        torch.set_num_threads(threads)
+        model = whisper.load_model("base.en")
+        result = model.transcribe(mp3_path, word_timestamps=True)
 
     timestamps = []
     current_start = 0.0
@@ -535,10 +1550,100 @@ def get_timestamps_from_whisper(mp3_path):
 # ================================================
 # 動画作成（2段階処理）
 # ================================================
-def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
-    """動画を作成"""
-    segment_files_final = []
+def render_segment(i, ts, img_path, jp_this, seg_total):
+    """1セグメント分のクリップを生成（英語字幕 → 日本語字幕＋網掛け）"""
+    seg_duration = ts["end"] - ts["start"]
+
+    # ── ステップ1：英語字幕だけをセンターに配置 ──
+    english_lines = split_text_to_lines(ts["text"], MAX_CHARS_PER_LINE)
+    line_count_eng = len(english_lines)
+
+    eng_block_height = (line_count_eng - 1) * LINE_SPACING
+    eng_center_y = 960
+    eng_start_y = eng_center_y - eng_block_height // 2
+
+    draw_eng = []
+    for j, line in enumerate(english_lines):
+        line_text = line.replace("'", "''")
+        y = eng_start_y + j * LINE_SPACING
+        draw_eng.append(
+            f"drawtext=text='{line_text}':fontcolor=white:fontsize=w/{ENGLISH_COEF}:borderw=4:bordercolor=black@0.6:"
+            f"x=(w-tw)/2:y={y}:{FONT_PART}"
+        )
+
+    vf_eng = BASE_VF
+    if draw_eng:
+        vf_eng += "," + ",".join(draw_eng)
+
+    english_clip = WORKSPACE.path(f"english_{i:02d}.mp4", hot=True)
+
+    cmd_eng = [
+        FFMPEG_PATH,
+        "-loop", "1",
+        "-i", img_path,
+        "-t", str(seg_duration),
+        "-vf", vf_eng,
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-preset", "ultrafast",
+        "-crf", "23",
+        english_clip,
+        "-y"
+    ]
 
+    print(f"📹 セグメント {i+1}/{seg_total} 英語クリップ生成中...")
+    run_ffmpeg(cmd_eng, check=True)
+    WORKSPACE.charge(english_clip)
+
+    # ── ステップ2：英語クリップに日本語字幕＋全体グレー網掛け ──
+    jp_lines = split_text_to_lines(jp_this, MAX_CHARS_PER_LINE_JP)
+    line_count_jp = len(jp_lines)
+
+    jp_bottom = 1920 - 100
+    jp_start_y = jp_bottom - (line_count_jp - 1) * JP_LINE_SPACING
+
+    draw_jp = []
+    for j, line in enumerate(jp_lines):
+        line_text = line.replace("'", "''")
+        y = jp_start_y + j * JP_LINE_SPACING
+        draw_jp.append(
+            f"drawtext=text='{line_text}':fontcolor=white:fontsize=w/{JP_COEF}:borderw=3:bordercolor=black@0.6:"
+            f"x=(w-tw)/2:y={y}:{FONT_PART}"
+        )
+
+    # 全体に薄いグレー網掛けを追加
+    overlay_filter = f"color=c=gray@0.35:s=1080x1920[gray];[0:v][gray]overlay=0:0:enable='between(t,0,{seg_duration})',eq=brightness=-0.08:contrast=1.05"
+
+    vf_jp = overlay_filter
+    if draw_jp:
+        vf_jp += "," + ",".join(draw_jp)
+
+    final_seg = WORKSPACE.path(f"segment_{i:02d}.mp4", hot=True)
+
+    cmd_jp = [
+        FFMPEG_PATH,
+        "-i", english_clip,
+        "-vf", vf_jp,
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-preset", "ultrafast",
+        "-crf", "23",
+        "-t", str(seg_duration),
+        final_seg,
+        "-y"
+    ]
+
+    print(f"🎬 セグメント {i+1}/{seg_total} に日本語＋グレー網掛けを追加中...")
+    run_ffmpeg(cmd_jp, check=True)
+    WORKSPACE.charge(final_seg)
+    WORKSPACE.release(english_clip)
+    return final_seg
+
+def prepare_concat_list(timestamps, images, japanese_text):
+    """
+    全セグメントと締めの黒背景クリップを生成
+    戻り値：(結合リストのパス, 結合するクリップのパス一覧)
+    """
     jp_sentences = re.split(r"(?<=。|！|？)", japanese_text)
     jp_sentences = [s.strip() for s in jp_sentences if s.strip()]
 
@@ -558,104 +1663,28 @@ def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
     for idx, group in enumerate(jp_groups, 1):
         print(f"  グループ {idx}: {group}")
 
-    for i, ts in enumerate(timestamps):
-        img_path = images[i % len(images)]
-        seg_duration = ts["end"] - ts["start"]
-
-        # ── ステップ1：英語字幕だけをセンターに配置 ──
-        english_lines = split_text_to_lines(ts["text"], MAX_CHARS_PER_LINE)
-        line_count_eng = len(english_lines)
-
-        eng_block_height = (line_count_eng - 1) * LINE_SPACING
-        eng_center_y = 960
-        eng_start_y = eng_center_y - eng_block_height // 2
-
-        draw_eng = []
-        for j, line in enumerate(english_lines):
-            line_text = line.replace("'", "''")
-            y = eng_start_y + j * LINE_SPACING
-            draw_eng.append(
-                f"drawtext=text='{line_text}':fontcolor=white:fontsize=w/{ENGLISH_COEF}:borderw=4:bordercolor=black@0.6:"
-                f"x=(w-tw)/2:y={y}:{FONT_PART}"
-            )
-
-        vf_eng = BASE_VF
-        if draw_eng:
-            vf_eng += "," + ",".join(draw_eng)
-
-        english_clip = os.path.join(WORK_DIR, f"english_{i:02d}.mp4")
-
-        cmd_eng = [
-            FFMPEG_PATH,
-            "-loop", "1",
-            "-i", img_path,
-            "-t", str(seg_duration),
-            "-vf", vf_eng,
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-preset", "ultrafast",
-            "-crf", "23",
-            english_clip,
-            "-y"
-        ]
-
-        print(f"📹 セグメント {i+1}/{len(timestamps)} 英語クリップ生成中...")
-        subprocess.run(cmd_eng, check=True)
-
-        # ── ステップ2：英語クリップに日本語字幕＋全体グレー網掛け ──
-        jp_this = jp_groups[i] if i < len(jp_groups) else ""
-        jp_lines = split_text_to_lines(jp_this, MAX_CHARS_PER_LINE_JP)
-        line_count_jp = len(jp_lines)
-
-        jp_bottom = 1920 - 100
-        jp_start_y = jp_bottom - (line_count_jp - 1) * JP_LINE_SPACING
-
-        draw_jp = []
-        for j, line in enumerate(jp_lines):
-            line_text = line.replace("'", "''")
-            y = jp_start_y + j * JP_LINE_SPACING
-            draw_jp.append(
-                f"drawtext=text='{line_text}':fontcolor=white:fontsize=w/{JP_COEF}:borderw=3:bordercolor=black@0.6:"
-                f"x=(w-tw)/2:y={y}:{FONT_PART}"
-            )
-
-        # 全体に薄いグレー網掛けを追加
-        overlay_filter = f"color=c=gray@0.35:s=1080x1920[gray];[0:v][gray]overlay=0:0:enable='between(t,0,{seg_duration})',eq=brightness=-0.08:contrast=1.05"
-
-        vf_jp = overlay_filter
-        if draw_jp:
-            vf_jp += "," + ",".join(draw_jp)
-
-        final_seg = os.path.join(WORK_DIR, f"segment_{i:02d}.mp4")
-
-        cmd_jp = [
-            FFMPEG_PATH,
-            "-i", english_clip,
-            "-vf", vf_jp,
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-preset", "ultrafast",
-            "-crf", "23",
-            "-t", str(seg_duration),
-            final_seg,
-            "-y"
+    # セグメントは CPU予算に応じて並列生成（各 ffmpeg が FFMPEG_JOB_THREADS を確保）
+    max_workers = max(1, CPU_BUDGET // max(1, FFMPEG_JOB_THREADS))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                render_segment, i, ts, images[i % len(images)],
+                jp_groups[i] if i < len(jp_groups) else "", seg_count)
+            for i, ts in enumerate(timestamps)
         ]
+        segment_files_final = [future.result() for future in futures]
 
-        print(f"🎬 セグメント {i+1}/{len(timestamps)} に日本語＋グレー網掛けを追加中...")
-        subprocess.run(cmd_jp, check=True)
-
-        segment_files_final.append(final_seg)
+    # 元画像はセグメント生成で使い終わり
+    WORKSPACE.release(*images)
 
     # ── 最終結合 ──
-    concat_list_path = os.path.join(WORK_DIR, "concat.txt")
+    concat_list_path = WORKSPACE.path("concat.txt", hot=True)
     with open(concat_list_path, "w", encoding="utf-8") as f:
         for seg in segment_files_final:
             f.write(f"file '{seg}'\n")
 
-    final_output = os.path.join(WORK_DIR, "final_tiktok_video.mp4")
-
     if USE_FINAL_BLACK_MESSAGE:
-        black_clip = os.path.join(WORK_DIR, "black_05sec.mp4")
+        black_clip = WORKSPACE.path("black_05sec.mp4", hot=True)
         cmd_black = [
             FFMPEG_PATH,
             "-f", "lavfi",
@@ -664,14 +1693,14 @@ def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
             black_clip,
             "-y"
         ]
-        subprocess.run(cmd_black, check=True)
+        run_ffmpeg(cmd_black, check=True)
 
         final_message_vf = (
             f"drawtext=text='{FINAL_MESSAGE}':fontcolor=white:fontsize=100:borderw=6:bordercolor=black:"
             f"box=0:x=(w-tw)/2:y=(h-th)/2:enable='between(t,0,{FINAL_MESSAGE_DURATION})':{FONT_PART}"
         )
 
-        black_with_text = os.path.join(WORK_DIR, "black_with_text.mp4")
+        black_with_text = WORKSPACE.path("black_with_text.mp4", hot=True)
         cmd_text = [
             FFMPEG_PATH,
             "-i", black_clip,
@@ -682,12 +1711,19 @@ def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
             black_with_text,
             "-y"
         ]
-        subprocess.run(cmd_text, check=True)
+        run_ffmpeg(cmd_text, check=True)
+        WORKSPACE.release(black_clip)
+        segment_files_final.append(black_with_text)
 
         with open(concat_list_path, "a", encoding="utf-8") as f:
             f.write(f"file '{black_with_text}'\n")
 
-    cmd_concat = [
+    WORKSPACE.charge(concat_list_path, *segment_files_final)
+    return concat_list_path, segment_files_final
+
+def build_mux_cmd(concat_list_path, narration_path, bgm_path, output, output_args=()):
+    """結合リスト＋ナレーション＋BGM を最終動画にまとめる ffmpeg コマンド"""
+    return [
         FFMPEG_PATH,
         "-f", "concat",
         "-safe", "0",
@@ -703,12 +1739,19 @@ def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
         "-c:v", "copy",
         "-c:a", "aac",
         "-shortest",
-        final_output,
+        *output_args,
+        output,
         "-y"
     ]
 
+def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
+    """動画を作成"""
+    concat_list_path, clips = prepare_concat_list(timestamps, images, japanese_text)
+    final_output = os.path.join(WORK_DIR, "final_tiktok_video.mp4")
+    cmd_concat = build_mux_cmd(concat_list_path, narration_path, bgm_path, final_output)
+
     print("\n🎞️ 全セグメントを結合中...")
-    result = subprocess.run(cmd_concat, capture_output=True, text=True)
+    result = run_ffmpeg(cmd_concat, threads=1, capture_output=True, text=True)
 
     print(f"FFmpeg 戻り値: {result.returncode}")
     if result.returncode != 0:
@@ -717,21 +1760,96 @@ def create_video(timestamps, images, japanese_text, bgm_path, narration_path):
         print("================")
         sys.exit(1)
 
+    # 結合に使った中間ファイルは不要
+    WORKSPACE.release(concat_list_path, *clips, narration_path, bgm_path)
+    WORKSPACE.charge(final_output)
+
     print(f"\n✅ 動画生成完了: {final_output}")
     return final_output
 
+def create_video_streaming(timestamps, images, japanese_text, bgm_path, narration_path, folder_id, session_id):
+    """
+    動画を作成しながら Drive へストリーミングアップロード
+    最終結合を fragmented MP4 でパイプ出力し、エンコード中からチャンク送信する
+    """
+    concat_list_path, clips = prepare_concat_list(timestamps, images, japanese_text)
+    cmd_concat = build_mux_cmd(
+        concat_list_path, narration_path, bgm_path, "pipe:1",
+        output_args=("-movflags", "frag_keyframe+empty_moov", "-f", "mp4")
+    )
+    file_name = next_video_file_name(folder_id, session_id)
+    log_path = os.path.join(WORK_DIR, "mux_stream.log")
+
+    print(f"\n🎞️ 全セグメントを結合しながらアップロード中... ({file_name})")
+    returncode = None
+    with CPU_SCHEDULER.lease(1) as threads, open(log_path, "w", encoding="utf-8") as log:
+        proc = subprocess.Popen(with_ffmpeg_threads(cmd_concat, threads), stdout=subprocess.PIPE, stderr=log)
+
+        def mux_succeeded():
+            # ffmpeg が正常終了した場合のみアップロードを確定させる
+            nonlocal returncode
+            returncode = proc.wait()
+            return returncode == 0
+
+        try:
+            video_id = stream_upload_to_drive(proc.stdout, folder_id, file_name, commit_check=mux_succeeded)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            proc.stdout.close()
+
+    # ffmpeg のログも作業領域の使用量に含める
+    WORKSPACE.charge(log_path)
+    print(f"FFmpeg 戻り値: {returncode}")
+    if not video_id:
+        # 最終チャンクを送らずにアップロードを破棄済み（Drive にファイルは作成されない）
+        print("=== エラー詳細 ===")
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            print(f.read())
+        print("================")
+        sys.exit(1)
+
+    WORKSPACE.release(concat_list_path, *clips, narration_path, bgm_path, log_path)
+
+    print(f"\n✅ 動画生成・アップロード完了: {file_name}")
+    return video_id
+
 # ================================================
 # メイン処理
 # ================================================
 async def main_async(session_id):
-    """メイン処理"""
-    global WORK_DIR
+    """
+    メイン処理
+    戻り値：動画を生成した場合 True、他プロセスが生成中・作業領域待ちのタイムアウトで見送った場合 False
+    """
+    global WORK_DIR, WORKSPACE
     
-    # 作業ディレクトリ作成
-    WORK_DIR = tempfile.mkdtemp(prefix=f"tiktok_rec_{session_id}_")
-    print(f"\n📁 作業ディレクトリ: {WORK_DIR}")
+    # 自動スキャン（cron）や ingest_server.py が同じ行を重複して生成しないよう O列で確保
+    # （作業領域の予算待ちより先に確保し、同じ行で待つプロセスが溜まらないようにする）
+    claim = claim_render(session_id)
+    if claim is None:
+        print(f"⏭️ Session '{session_id}' は他のプロセスで動画生成中のためスキップします")
+        return False
     
+    WORKSPACE = None
+    keep_claim = False
     try:
+        # 作業ディレクトリ作成（小さな中間ファイルは RAM ディスク側）
+        try:
+            WORKSPACE = SessionWorkspace(session_id)
+        except TimeoutError as e:
+            print(f"⏭️ {e}。次回の実行で再試行します")
+            return False
+        WORK_DIR = WORKSPACE.disk_dir
+        print(f"\n📁 作業ディレクトリ: {WORK_DIR}")
+        if WORKSPACE.ram_dir:
+            print(f"📁 RAM作業ディレクトリ: {WORKSPACE.ram_dir}")
+        
+        # 長時間動くプロセス（ingest_server.py）でも一覧が古くならないよう毎回差分同期
+        get_drive_index().refresh()
+        
         # 1. スプレッドシートからテキスト取得
         print("\n=== ステップ1: テキスト取得 ===")
         japanese_text, english_text, bgm_genre = get_text_from_sheet(session_id)
@@ -739,6 +1857,9 @@ async def main_async(session_id):
         # 2. Google Drive からファイルダウンロード
         print("\n=== ステップ2: ファイルダウンロード ===")
         
+        # 未取得のフォルダ一覧はバッチリクエストでまとめて取得
+        get_drive_index().prefetch([BGM_FOLDER_ID, PICTURE_FOLDER_ID, VIDEO_FOLDER_ID])
+        
         # BGM を取得（ジャンルに応じて）
         print(f"🎵 BGM をダウンロード中... (ジャンル: {bgm_genre})")
         bgm_path = download_bgm_by_genre(bgm_genre)
@@ -752,8 +1873,8 @@ async def main_async(session_id):
             raise ValueError("画像ファイルが見つかりません")
         
         # 画像をTikTok縦型に変換
-        for img_path in image_paths:
-            convert_to_tiktok_vertical(img_path)
+        convert_images_to_tiktok_vertical(image_paths)
+        WORKSPACE.charge(*image_paths)
         
         # 3. TTS生成
         print("\n=== ステップ3: TTS生成 ===")
@@ -763,36 +1884,105 @@ async def main_async(session_id):
         print("\n=== ステップ4: タイムスタンプ取得 ===")
         timestamps = get_timestamps_from_whisper(narration_path)
         
-        # 5. 動画生成
-        print("\n=== ステップ5: 動画生成 ===")
-        video_path = create_video(timestamps, image_paths, japanese_text, bgm_path, narration_path)
-        
-        # 6. Google Drive にアップロード
-        print("\n=== ステップ6: Google Drive にアップロード ===")
-        video_id = upload_file_to_drive(video_path, VIDEO_FOLDER_ID, session_id)
+        if STREAM_UPLOAD:
+            # 5-6. 動画生成と Google Drive へのアップロードを並行実行
+            print("\n=== ステップ5-6: 動画生成 + ストリーミングアップロード ===")
+            video_id = create_video_streaming(
+                timestamps, image_paths, japanese_text, bgm_path, narration_path,
+                VIDEO_FOLDER_ID, session_id
+            )
+        else:
+            # 5. 動画生成
+            print("\n=== ステップ5: 動画生成 ===")
+            video_path = create_video(timestamps, image_paths, japanese_text, bgm_path, narration_path)
+            
+            # 6. Google Drive にアップロード
+            print("\n=== ステップ6: Google Drive にアップロード ===")
+            video_id = upload_file_to_drive(video_path, VIDEO_FOLDER_ID, session_id)
+            WORKSPACE.release(video_path)
         
         # 7. スプレッドシートの I列（videoFileId）を更新
         if video_id:
             print(f"\n=== ステップ7: スプレッドシート更新 ===")
-            update_sheet_video_id(session_id, video_id)
+            if not update_sheet_video_id(session_id, video_id):
+                # I列が空のままだと次回の自動スキャンで重複生成されるため、確保を残して異常終了
+                keep_claim = True
+                raise RuntimeError(
+                    f"動画はアップロード済みですが I列を更新できませんでした。"
+                    f"Session '{session_id}' の I列に {video_id} を手動で入力してください")
         
         print("\n✅ 全処理完了！")
+        return True
     
     finally:
-        # 作業ディレクトリ削除
-        if WORK_DIR and os.path.exists(WORK_DIR):
-            shutil.rmtree(WORK_DIR)
+        # 作業ディレクトリ削除（後続の処理が失敗しても作業領域と台帳を残さない）
+        if WORKSPACE:
+            WORKSPACE.cleanup()
             print(f"\n🗑️ 作業ディレクトリを削除しました")
+        
+        # 確保を解除（O列がこの実行の確保のままの場合のみ）
+        if not keep_claim:
+            release_render_claim(session_id, claim)
+        
+        report_api_metrics()
+
+# ================================================
+# 起動時間ベンチマーク
+# ================================================
+def benchmark_startup(runs=5):
+    """
+    別プロセスで fftts の import 時間を計測し、重いモジュールが読み込まれていないか確認
+    中央値が IMPORT_BUDGET_SEC 以内かつ HEAVY_MODULES が未読み込みなら True
+    """
+    code = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "import fftts\n"
+        "print(time.perf_counter() - t)\n"
+        "print(','.join(m for m in fftts.HEAVY_MODULES if m in sys.modules))\n"
+    )
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+
+    timings = []
+    loaded = ""
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=module_dir,
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            print("❌ import fftts に失敗しました")
+            print(result.stderr.strip())
+            return False
+        elapsed, loaded = (result.stdout.splitlines() + [""])[:2]
+        timings.append(float(elapsed))
+
+    median = sorted(timings)[len(timings) // 2]
+    print(f"⏱️ import fftts: 中央値 {median * 1000:.0f}ms (上限 {IMPORT_BUDGET_SEC * 1000:.0f}ms, {runs}回)")
+    if loaded:
+        print(f"❌ 起動時に重いモジュールが読み込まれています: {loaded}")
+    return median <= IMPORT_BUDGET_SEC and not loaded
 
 # ================================================
 # エントリーポイント
 # ================================================
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    if len(sys.argv) >= 2 and sys.argv[1] == "--check":
+        # 処理対象の有無だけを確認（終了コード 0: あり / 1: なし / 2: 確認失敗）
+        unprocessed = scan_unprocessed_rows()
+        if unprocessed is None:
+            sys.exit(2)
+        sys.exit(0 if unprocessed else 1)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--bench-import":
+        # 起動時間の回帰チェック（終了コード 0: 予算内 / 1: 超過）
+        sys.exit(0 if benchmark_startup() else 1)
+    elif len(sys.argv) < 2:
         # 引数なし = 自動スキャンモード
         print("🔄 自動スキャンモード: スプレッドシートから未処理の行を検出中...")
         unprocessed = scan_unprocessed_rows()
         
+        if unprocessed is None:
+            sys.exit(2)
         if not unprocessed:
             print("✅ 処理する行がありません")
             sys.exit(0)
@@ -0,0 +1,358 @@
+# ingest_server.py （録音チャンクの受信サーバー + fftts.py 連携）
+# - app.js から音声チャンクをバイナリのまま HTTP PUT で受信（base64 / GAS 経由なし）
+# - セッション単位でローカルに保存・結合し、Whisper で文字起こし
+# - 台本生成（GAS generate_script）に文字起こしを直接渡し、完了後そのまま fftts.py の動画生成を実行
+#
+# エンドポイント:
+#   PUT  /sessions/<sessionId>/chunks/<NN>   チャンク本体（Content-Length 必須）
+#   POST /sessions/<sessionId>/complete      録音終了（JSON: {"chunks": N}、1..N がすべて揃っていること）
+#   GET  /sessions/<sessionId>               セッション状態
+# すべてのリクエストに X-Ingest-Token ヘッダー（INGEST_TOKEN と同じ値）が必要
+
+import os
+import re
+import sys
+import hmac
+import json
+import queue
+import shutil
+import asyncio
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fftts
+
+# ================================================
+# 環境設定
+# ================================================
+INGEST_HOST = os.getenv("INGEST_HOST", "127.0.0.1")
+INGEST_PORT = int(os.getenv("INGEST_PORT", "8765"))
+INGEST_DIR = os.getenv("INGEST_DIR", "./ingest")
+# 録音画面（index.html）を配信しているオリジン。カンマ区切りで複数指定可
+INGEST_ALLOWED_ORIGINS = [
+    origin.strip() for origin in os.getenv("INGEST_ALLOWED_ORIGIN", "http://127.0.0.1:8000").split(",") if origin.strip()
+]
+INGEST_TOKEN = os.getenv("INGEST_TOKEN")
+INGEST_MAX_CHUNK_BYTES = int(os.getenv("INGEST_MAX_CHUNK_MB", "200")) * 1024 * 1024
+INGEST_WHISPER_MODEL = os.getenv("INGEST_WHISPER_MODEL", "small")
+GAS_API_URL = os.getenv("GAS_API_URL")
+
+READ_BLOCK_SIZE = 64 * 1024
+MIN_TEXT_LENGTH = 10  # tiktok_rec.js の CONFIG.MIN_TEXT_LENGTH と同じ
+
+SESSION_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+CHUNK_PATH_PATTERN = re.compile(r'^/sessions/([^/]+)/chunks/(\d{1,4})$')
+COMPLETE_PATH_PATTERN = re.compile(r'^/sessions/([^/]+)/complete$')
+SESSION_PATH_PATTERN = re.compile(r'^/sessions/([^/]+)$')
+
+# 状態の遷移: receiving → complete → assembled → scripted → rendered
+# （失敗時は failed、他プロセスが生成中などで見送った場合は deferred：fftts.py の自動スキャンが拾う）
+render_queue = queue.Queue()
+state_lock = threading.RLock()
+
+# ================================================
+# セッション管理
+# ================================================
+def session_dir(session_id):
+    return os.path.join(INGEST_DIR, session_id)
+
+def chunk_path(session_id, chunk_num):
+    # Drive 上の命名（<sessionId>_chunkNN.webm）と揃える
+    return os.path.join(session_dir(session_id), f"{session_id}_chunk{chunk_num:02d}.webm")
+
+def list_chunks(session_id):
+    """受信済みチャンクを番号順に返す"""
+    pattern = re.compile(rf'^{re.escape(session_id)}_chunk(\d+)\.webm$')
+    chunks = []
+    if os.path.isdir(session_dir(session_id)):
+        for name in os.listdir(session_dir(session_id)):
+            match = pattern.match(name)
+            if match:
+                chunks.append((int(match.group(1)), os.path.join(session_dir(session_id), name)))
+    return [path for _, path in sorted(chunks)]
+
+def load_state(session_id):
+    try:
+        with open(os.path.join(session_dir(session_id), "state.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"status": "receiving"}
+
+def purge_session_files(session_id):
+    """処理済みセッションの音声・中間ファイルを削除（state.json のみ残す）"""
+    directory = session_dir(session_id)
+    for name in os.listdir(directory):
+        if name == "state.json":
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+def save_state(session_id, **updates):
+    with state_lock:
+        state = load_state(session_id)
+        state.update(updates)
+        path = os.path.join(session_dir(session_id), "state.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return state
+
+# ================================================
+# 結合・文字起こし・動画生成
+# ================================================
+def assemble_session(session_id):
+    """チャンク（それぞれ独立した webm）を ffmpeg の concat で1ファイルに結合"""
+    chunks = list_chunks(session_id)
+    concat_list_path = os.path.join(session_dir(session_id), "concat.txt")
+    with open(concat_list_path, "w", encoding="utf-8") as f:
+        for path in chunks:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+
+    output = os.path.join(session_dir(session_id), f"{session_id}.webm")
+    cmd = [
+        fftts.FFMPEG_PATH,
+        "-f", "concat",
+        "-safe", "0",
+        "-i", concat_list_path,
+        "-c", "copy",
+        output,
+        "-y"
+    ]
+    fftts.run_ffmpeg(cmd, threads=1, check=True, capture_output=True)
+    return output
+
+def transcribe_session(audio_path):
+    """Whisper で日本語の文字起こし"""
+    import torch
+    import whisper
+
+    with fftts.CPU_SCHEDULER.lease(fftts.CPU_BUDGET) as threads:
+        torch.set_num_threads(threads)
+        model = whisper.load_model(INGEST_WHISPER_MODEL)
+        result = model.transcribe(audio_path, language="ja")
+    return result["text"].strip()
+
+def request_script(session_id, transcript):
+    """GAS の generate_script に文字起こしを渡してスプレッドシートに台本を書き込ませる"""
+    body = json.dumps({
+        "action": "generate_script",
+        "sessionId": session_id,
+        "transcript": transcript
+    }).encode("utf-8")
+    request = urllib.request.Request(GAS_API_URL, data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=300) as response:
+        result = json.loads(response.read().decode("utf-8"))
+    if result.get("status") != "success":
+        raise RuntimeError(f"台本生成に失敗しました: {result.get('message')}")
+
+def process_session(session_id):
+    """完了したセッションを結合 → 文字起こし → 台本生成 → 動画生成まで進める"""
+    state = load_state(session_id)
+
+    if state["status"] == "complete":
+        print(f"🔗 チャンク結合中: {session_id}")
+        audio_path = assemble_session(session_id)
+        state = save_state(session_id, status="assembled", audio=audio_path)
+
+    if state["status"] == "assembled":
+        print(f"📝 文字起こし中: {session_id}")
+        transcript = transcribe_session(state["audio"])
+        if len(transcript) < MIN_TEXT_LENGTH:
+            raise ValueError(f"有意な内容がありません: {transcript!r}")
+        request_script(session_id, transcript)
+        state = save_state(session_id, status="scripted")
+
+    if state["status"] == "scripted":
+        print(f"🎬 動画生成開始: {session_id}")
+        if asyncio.run(fftts.main_async(session_id)):
+            save_state(session_id, status="rendered")
+            purge_session_files(session_id)
+        else:
+            save_state(session_id, status="deferred")
+
+def render_worker():
+    """セッションを1件ずつ処理（並列度は fftts の CPU予算側で管理）"""
+    while True:
+        session_id = render_queue.get()
+        try:
+            process_session(session_id)
+            print(f"✅ セッション処理完了: {session_id}")
+        except (Exception, SystemExit) as e:
+            # fftts は致命的エラーで sys.exit するため SystemExit も捕捉してサーバーを止めない
+            print(f"❌ セッション処理エラー ({session_id}): {e}")
+            save_state(session_id, status="failed", error=str(e))
+        finally:
+            render_queue.task_done()
+
+def resume_pending_sessions():
+    """再起動時、完了済みで未処理のセッションを再投入"""
+    if not os.path.isdir(INGEST_DIR):
+        return
+    for session_id in sorted(os.listdir(INGEST_DIR)):
+        if load_state(session_id)["status"] in ("complete", "assembled", "scripted"):
+            print(f"🔄 処理を再開: {session_id}")
+            render_queue.put(session_id)
+
+# ================================================
+# HTTP ハンドラ
+# ================================================
+class IngestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message):
+        self._send_json(code, {"status": "error", "message": message})
+
+    def _send_cors_headers(self):
+        # 許可したオリジンにだけ応答を読ませる（ワイルドカードは使わない）
+        origin = self.headers.get("Origin")
+        if origin in INGEST_ALLOWED_ORIGINS:
+            self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+
+    def _authorized(self):
+        token = self.headers.get("X-Ingest-Token") or ""
+        if not hmac.compare_digest(token.encode("utf-8"), INGEST_TOKEN.encode("utf-8")):
+            self._error(401, "認証トークンが不正です")
+            return False
+        return True
+
+    def _content_length(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._error(400, "Content-Length が不正です")
+            return None
+        return length
+
+    def _valid_session(self, session_id):
+        if not SESSION_ID_PATTERN.match(session_id):
+            self._error(400, f"不正な sessionId: {session_id}")
+            return False
+        return True
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._send_cors_headers()
+        self.send_header("Access-Control-Allow-Methods", "GET, PUT, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Ingest-Token")
+        self.end_headers()
+
+    def do_PUT(self):
+        match = CHUNK_PATH_PATTERN.match(self.path)
+        if not match:
+            return self._error(404, "Not found")
+        session_id, chunk_num = match.group(1), int(match.group(2))
+        if not self._authorized() or not self._valid_session(session_id):
+            return
+
+        if "Content-Length" not in self.headers:
+            return self._error(411, "Content-Length が必要です")
+        remaining = self._content_length()
+        if remaining is None:
+            return
+        if remaining > INGEST_MAX_CHUNK_BYTES:
+            return self._error(413, "チャンクが大きすぎます")
+        if load_state(session_id)["status"] != "receiving":
+            return self._error(409, "セッションは既に完了しています")
+
+        os.makedirs(session_dir(session_id), exist_ok=True)
+        path = chunk_path(session_id, chunk_num)
+        part_path = path + f".{threading.get_ident()}.part"
+
+        # メモリに溜めずにそのままディスクへ書き込み、完了後にリネーム（再送は上書き）
+        with open(part_path, "wb") as f:
+            while remaining > 0:
+                block = self.rfile.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                f.write(block)
+                remaining -= len(block)
+        if remaining > 0:
+            os.remove(part_path)
+            return self._error(400, "チャンクの受信が途中で終了しました")
+        os.replace(part_path, path)
+
+        print(f"📥 チャンク受信: {os.path.basename(path)} ({os.path.getsize(path)} bytes)")
+        self._send_json(200, {"status": "success", "message": f"Chunk uploaded: {os.path.basename(path)}"})
+
+    def do_POST(self):
+        match = COMPLETE_PATH_PATTERN.match(self.path)
+        if not match:
+            return self._error(404, "Not found")
+        session_id = match.group(1)
+        if not self._authorized() or not self._valid_session(session_id):
+            return
+
+        length = self._content_length()
+        if length is None:
+            return
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._error(400, "JSON が不正です")
+
+        expected = data.get("chunks") if isinstance(data, dict) else None
+        if isinstance(expected, bool) or not isinstance(expected, int) or expected < 1:
+            return self._error(400, "chunks には録音したチャンク数（1以上の整数）を指定してください")
+
+        chunks = list_chunks(session_id)
+        if not chunks:
+            return self._error(404, f"チャンクが見つかりません: {session_id}")
+        # 途中のチャンクが欠けたまま結合すると音声が無言で抜けるため、1..N がすべて揃うまで受け付けない
+        missing = [num for num in range(1, expected + 1) if not os.path.exists(chunk_path(session_id, num))]
+        if missing:
+            return self._error(409, f"チャンクが不足しています (欠番: {', '.join(f'{num:02d}' for num in missing)})")
+
+        with state_lock:
+            if load_state(session_id)["status"] != "receiving":
+                return self._send_json(200, {"status": "success", "message": "処理中です", "sessionId": session_id})
+            save_state(session_id, status="complete", chunks=len(chunks))
+        render_queue.put(session_id)
+        self._send_json(202, {"status": "success", "message": f"動画生成をキューに追加しました: {session_id}", "sessionId": session_id})
+
+    def do_GET(self):
+        match = SESSION_PATH_PATTERN.match(self.path)
+        if not match:
+            return self._error(404, "Not found")
+        session_id = match.group(1)
+        if not self._authorized() or not self._valid_session(session_id):
+            return
+        state = load_state(session_id)
+        state["received"] = len(list_chunks(session_id))
+        self._send_json(200, {"status": "success", "data": state})
+
+# ================================================
+# エントリーポイント
+# ================================================
+if __name__ == "__main__":
+    if not GAS_API_URL:
+        print("❌ GAS_API_URL が設定されていません")
+        sys.exit(1)
+    if not INGEST_TOKEN:
+        print("❌ INGEST_TOKEN が設定されていません（app.js と同じ値を設定してください）")
+        sys.exit(1)
+
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    threading.Thread(target=render_worker, daemon=True).start()
+    resume_pending_sessions()
+
+    server = ThreadingHTTPServer((INGEST_HOST, INGEST_PORT), IngestHandler)
+    print(f"📡 Ingest サーバー起動: http://{INGEST_HOST}:{INGEST_PORT} (保存先: {INGEST_DIR})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 サーバーを停止します")
+        server.server_close()
@@ -152,10 +152,11 @@ function handleGenerateScript(data) {
     const formattedDate = Utilities.formatDate(now, 'Asia/Tokyo', 'yyyy/MM/dd HH:mm:ss');
 
     // 1. 既存のバックグラウンド処理済みテキストを検索 (sessionIdをキーに)
-    let fullTranscript = '';
+    //    ingest_server.py から呼ばれた場合はローカルで文字起こし済みのテキストを利用
+    let fullTranscript = data.transcript ? data.transcript + "\n\n" : '';
     const txtFolder = DriveApp.getFolderById(CONFIG.TXT_FOLDER_ID);
     const txtFiles = txtFolder.getFilesByType(MimeType.PLAIN_TEXT);
-    while (txtFiles.hasNext()) {
+    while (!fullTranscript && txtFiles.hasNext()) {
         const f = txtFiles.next();
         if (f.getDescription() === sessionId && !f.isTrashed()) {
             fullTranscript = f.getBlob().getDataAsString() + "\n\n";